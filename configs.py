@@ -183,7 +183,8 @@ Original functionality comes from SEPP -> sepp/config.py
 def _read_config_file(filename, opts, expand=None):
     Configs.debug('Reading config from {}'.format(filename))
     config_defaults = []
-    cparser = configparser.ConfigParser()
+    # no interpolation, matching how setup.py writes main.config
+    cparser = configparser.RawConfigParser()
     cparser.optionxform = str
     cparser.read_file(filename)
 
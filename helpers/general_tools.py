@@ -1,12 +1,24 @@
-import subprocess
+import os, subprocess
 
 def executeBinary(binpath):
+    # expand ~ and $VAR as the shell did (and as the pipeline's
+    # os.system calls still do)
+    binpath = os.path.expandvars(os.path.expanduser(binpath))
     args = ['-h']
     first = None
     for i in range(len(args)):
-        out = subprocess.run('{} {}'.format(binpath, args[i]),
-                shell=True, text=True, 
-                capture_output=True)
+        # invoke the binary directly (no shell) so that subprocess can use
+        # its posix_spawn/vfork fast path
+        try:
+            out = subprocess.run([binpath, args[i]],
+                    text=True, capture_output=True)
+        except OSError as e:
+            # mimic the shell's return codes for a missing (127) or
+            # non-executable (126) binary
+            returncode = 127 if isinstance(e, FileNotFoundError) else 126
+            out = subprocess.CompletedProcess([binpath, args[i]],
+                    returncode, stdout='', stderr='{}: {}'.format(
+                        binpath, e.strerror))
         if out.returncode == 0:
             return out, out.returncode
         if i == 0:
@@ -1,22 +1,75 @@
 #!/usr/bin/env python3
-import os, sys, shutil, subprocess, time, signal
+import os, sys, shutil, subprocess, time, signal, pickle
 try:
     import configparser
 except ImportError:
     import ConfigParser as configparser
 from argparse import ArgumentParser, Namespace
 from platform import platform
+from concurrent.futures import ThreadPoolExecutor
 from helpers.general_tools import executeBinary
 
 _root_dir = os.path.dirname(os.path.realpath(__file__))
 _config_path = os.path.join(_root_dir, 'default.config')
 
+'''
+helper functions to cache the parsed main.config as a pickle file, so that
+later runs do not need to re-parse it. The pickle stores main.config's
+(mtime_ns, size) and is only used if both still match exactly (e.g., not
+after manual edits or after main.config is replaced by another copy)
+'''
+def configStamp(config_path):
+    st = os.stat(config_path)
+    return (st.st_mtime_ns, st.st_size)
+
+def loadCachedConfig(config_path):
+    cache_path = config_path + '.pkl'
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            stamp, cparser = pickle.load(f)
+        if stamp != configStamp(config_path):
+            return None
+        return cparser
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+            ImportError, IndexError, TypeError, ValueError):
+        return None
+
+def writeCachedConfig(config_path, cparser):
+    try:
+        stamp = configStamp(config_path)
+        with open(config_path + '.pkl', 'wb') as f:
+            pickle.dump((stamp, cparser), f, pickle.HIGHEST_PROTOCOL)
+    except (OSError, pickle.PicklingError):
+        pass
+
+'''
+run a binary at most once per resolved path, since the same binaries are
+usually configured in both [Basic] and [MAGUS]. The resolved path (bare
+names looked up in PATH, then symlinks resolved) is only the cache key;
+the configured (or PATH-resolved) path itself is what gets invoked
+'''
+_probe_results = {}
+
+def resolveBinary(binpath):
+    path = os.path.expandvars(os.path.expanduser(binpath))
+    runpath = shutil.which(path) or binpath
+    return runpath, os.path.realpath(runpath)
+
+def probeBinary(runpath, key):
+    if key not in _probe_results:
+        _probe_results[key] = executeBinary(runpath)
+    return _probe_results[key]
+
 '''
 4.11.2024 - helper function to notify users which binary files are
             having issues running (defined in main.config)
 '''
-def processExecutableOutput(section, item, binpath):
-    out, returncode = executeBinary(binpath)
+def processExecutableOutput(section, item, binpath, resolved=None):
+    if resolved is None:
+        resolved = resolveBinary(binpath)
+    out, returncode = probeBinary(*resolved)
     b_err = 0
 
     # unnormal error & deal with mafft issue
@@ -33,11 +86,10 @@ def processExecutableOutput(section, item, binpath):
 
 def setup(prioritize_user_software, platform=platform()): 
     config_defaults = []
-    cparser = configparser.ConfigParser()
+    # main.config only holds literal values (e.g., paths), so it is written
+    # (and read back by configs._read_config_file) without interpolation
+    cparser = configparser.RawConfigParser()
     cparser.optionxform = str
-    assert os.path.exists('{}'.format(_config_path)), \
-            "default config file {} missing! Please redownload from Github\n".format(
-                    _config_path)
 
     main_config_path = os.path.join(_root_dir, 'main.config')
     if os.path.exists(main_config_path):
@@ -45,13 +97,22 @@ def setup(prioritize_user_software, platform=platform()):
         print('If you wish to regenerate configs, please delete the file above.')
         #ans = input('Do you wish to regenerate the file? [yes(y)/no(n)]:')
         #if ans != 'yes' and ans != 'y':
+        cached = loadCachedConfig(main_config_path)
+        if cached is not None:
+            return cached
         with open(main_config_path, 'r') as f:
             cparser.read_file(f)
+        writeCachedConfig(main_config_path, cparser)
         return cparser
 
+    # default.config is only needed when (re)generating main.config
+    assert os.path.exists('{}'.format(_config_path)), \
+            "default config file {} missing! Please redownload from Github\n".format(
+                    _config_path)
+
     print('\n')
     # initialize main config file using default config file
-    default_config = configparser.ConfigParser()
+    default_config = configparser.RawConfigParser()
     with open(_config_path, 'r') as f:
         default_config.read_file(f)
     for section in default_config.sections():
@@ -68,20 +129,20 @@ def setup(prioritize_user_software, platform=platform()):
         # use existing binaries from MAGUS subfolder (reduce redundancy of
         # duplicated binaries)
         _magus_tools_dir = os.path.join(_root_dir, 'tools', 'magus', 'tools') 
+        # collect the paths once and apply them to each section (update still
+        # goes through cparser.set, so each option is validated as before)
+        updates = {
+            'mafftpath': os.path.join(_magus_tools_dir, 'mafft', 'mafft'),
+            'mclpath': os.path.join(_magus_tools_dir, 'mcl', 'bin', 'mcl'),
+            'fasttreepath': os.path.join(_magus_tools_dir,
+                'fasttree', 'FastTreeMP'),
+            }
+        # hmmer packages
+        for hmmer_pkg in ['hmmsearch', 'hmmalign', 'hmmbuild']:
+            updates['{}path'.format(hmmer_pkg)] = os.path.join(
+                    _magus_tools_dir, 'hmmer', hmmer_pkg)
         for _section in set_sections:
-            # mafftpath
-            cparser.set(_section, 'mafftpath',
-                    os.path.join(_magus_tools_dir, 'mafft', 'mafft'))
-            # mclpath
-            cparser.set(_section, 'mclpath',
-                    os.path.join(_magus_tools_dir, 'mcl', 'bin', 'mcl'))
-            # fasttreepath
-            cparser.set(_section, 'fasttreepath',
-                    os.path.join(_magus_tools_dir, 'fasttree', 'FastTreeMP'))
-            # hmmer packages
-            for hmmer_pkg in ['hmmsearch', 'hmmalign', 'hmmbuild']:
-                cparser.set(_section, '{}path'.format(hmmer_pkg),
-                        os.path.join(_magus_tools_dir, 'hmmer', hmmer_pkg))
+            cparser[_section].update(updates)
     else:
         if 'x86' not in platform:
             print('Warning: system is not using x86 architecture.',
@@ -93,14 +154,17 @@ def setup(prioritize_user_software, platform=platform()):
         # configure MAGUS to use macOS compatible executables
         _macOS_dir = os.path.join(_root_dir, 'tools', 'macOS')
 
-        binaries = os.popen('ls {}'.format(_macOS_dir)).read().split('\n')[:-1]
+        binaries = sorted(b for b in os.listdir(_macOS_dir)
+                if not b.startswith('.'))
+        updates = {}
         for binary in binaries:
             path = os.path.join(_macOS_dir, binary)
-            for _section in set_sections:
-                if 'FastTreeMP' in path:
-                    cparser.set(_section, 'fasttreepath', path)
-                else:
-                    cparser.set(_section, '{}path'.format(binary), path)
+            if 'FastTreeMP' in path:
+                updates['fasttreepath'] = path
+            else:
+                updates['{}path'.format(binary)] = path
+        for _section in set_sections:
+            cparser[_section].update(updates)
 
     # binaries from the user's environment will be used in priority
     # if they exist
@@ -108,19 +172,23 @@ def setup(prioritize_user_software, platform=platform()):
         print('Detecting existing software from the user\'s environment...')
         software = ['mafft', 'mcl',  
                 'hmmsearch', 'hmmalign', 'hmmbuild', 'FastTreeMP']
-        for soft in software:
-            print('\t{}: {}'.format(soft, shutil.which(soft)))
-            for _section in set_sections:
-                if shutil.which(soft):
-                    if soft != 'FastTreeMP':
-                        cparser.set(_section, '{}path'.format(soft),
-                                shutil.which(soft))
-                    else:
-                        cparser.set(_section, 'fasttreepath',
-                                shutil.which(soft))
+        # resolve each software only once
+        resolved = {soft: shutil.which(soft) for soft in software}
+        updates = {}
+        for soft, soft_path in resolved.items():
+            print('\t{}: {}'.format(soft, soft_path))
+            if not soft_path:
+                continue
+            if soft != 'FastTreeMP':
+                updates['{}path'.format(soft)] = soft_path
+            else:
+                updates['fasttreepath'] = soft_path
+        for _section in set_sections:
+            cparser[_section].update(updates)
 
     with open(main_config_path, 'w') as f:
         cparser.write(f)
+    writeCachedConfig(main_config_path, cparser)
     print('\n(Done) main.config written to {}'.format(main_config_path))
     print('If you would like to make manual changes, please directly edit {}'.format(
         main_config_path))
@@ -150,12 +218,22 @@ def main():
     4.11.2024 - Added post-setup check on softwares to see if they can run
     '''
     print('\nChecking if binary executables can run...')
+    triples = [(_section, k, v) for _section in ['Basic', 'MAGUS']
+            for k, v in configs[_section].items() if 'path' in k]
+    # resolve each binary once, invoke each unique one concurrently, then
+    # check their return codes in order so that the printed messages are
+    # not interleaved
+    resolved = [resolveBinary(v) for _, _, v in triples]
+    pending = {}
+    for runpath, key in resolved:
+        if key not in _probe_results:
+            pending.setdefault(key, runpath)
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+        _probe_results.update(zip(pending,
+            executor.map(executeBinary, pending.values())))
     num_err = 0
-    for _section in ['Basic', 'MAGUS']:
-        for k, v in configs[_section].items():
-            # invoke the binaries and check their return codes
-            if 'path' in k:
-                num_err += processExecutableOutput(_section, k, v)
+    for (_section, k, v), pair in zip(triples, resolved):
+        num_err += processExecutableOutput(_section, k, v, pair)
     if num_err == 0:
         print('All executables ran successfully...')
 
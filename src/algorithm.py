@@ -8,7 +8,7 @@ Modified on 6.27.2022 by Chengze Shen
 Algorithms for tree decomposition and hmmsearch.
 '''
 
-import re, os, subprocess, math, time, psutil, shutil 
+import re, os, subprocess, math, time, psutil, shutil, json
 from functools import partial
 from tqdm import tqdm
 
@@ -526,7 +526,7 @@ def subset_frag_chunk_hmmsearch(lock, binary, piped, elim, filters, args):
     # modify the output file and only retain taxon name, E-value, bit-score
     res = evalHMMSearchOutput(hmmsearch_path)
     with open(hmmsearch_path, 'w') as f:
-        f.write(str(res))
+        json.dump(res, f)
 
     lock.acquire()
     try:
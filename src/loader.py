@@ -1,62 +1,168 @@
-import time, os
-import subprocess
+import time, os, json, ast
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+import numpy as np
 
 from configs import Configs 
 from helpers.alignment_tools import Alignment
 
+# number of threads used for reading HMM/hmmsearch files (I/O-bound)
+_max_io_workers = min(32, (os.cpu_count() or 1) * 4)
+
+# (alignment_ind, hmm_ind, bitscore) fields of a single hmmsearch score
+_score_dtype = [('alignment_ind', 'i8'), ('hmm_ind', 'i8'), ('bitscore', 'f8')]
+
+'''
+Recursively find all files under indir whose names start with prefix,
+using os.scandir instead of spawning a "find" subprocess
+'''
+def findFiles(indir, prefix):
+    paths = []
+    with os.scandir(indir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                paths.extend(findFiles(entry.path, prefix))
+            elif entry.name.startswith(prefix) and entry.is_file():
+                paths.append(entry.path)
+    return paths
+
+'''
+Find all hmmbuild.model.* and hmmsearch.results.* files under indir in a
+single (recursive os.scandir) directory walk. Returns a dictionary of
+dirname -> {'hmmbuild': [paths], 'hmmsearch': [paths],
+            'subalignment': DirEntry of subset.aln.fasta or None}
+The DirEntry objects keep the file type read from the directory listing,
+so the sub-alignments do not need to be stat-ed again later
+'''
+def discoverHMMFiles(indir, discovered=None):
+    if discovered is None:
+        discovered = {}
+    hmmbuild, hmmsearch, subalignment, subdirs = [], [], None, []
+    with os.scandir(indir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.startswith('hmmbuild.model.'):
+                hmmbuild.append(entry.path)
+            elif entry.name.startswith('hmmsearch.results.'):
+                hmmsearch.append(entry.path)
+            elif entry.name == 'subset.aln.fasta':
+                subalignment = entry
+    if len(hmmbuild) > 0 or len(hmmsearch) > 0 or subalignment is not None:
+        discovered[os.path.normpath(indir)] = {'hmmbuild': hmmbuild,
+                'hmmsearch': hmmsearch, 'subalignment': subalignment}
+    for subdir in subdirs:
+        discoverHMMFiles(subdir, discovered)
+    return discovered
+
+'''
+Count the number of records in a FASTA file by counting '>' bytes,
+instead of running "wc -l" on it
+'''
+def countFastaRecords(path, chunk_size=1 << 20):
+    count = 0
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            count += chunk.count(b'>')
+            chunk = f.read(chunk_size)
+    return count
+
+'''
+Parse the content of a processed hmmsearch.results.* file. Newer files are
+written as JSON; older ones may still be a Python dict repr, which is
+parsed with ast.literal_eval (never eval)
+'''
+def readHMMSearchScores(raw):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
+'''
+Read the header of a single HMMBuild file and the size of its corresponding
+sub-alignment. Returns None if the HMM is not within [lower, upper] (unless
+keep_all is set)
+'''
+def readHMMInfo(lower, upper, keep_all, hmm_files, path):
+    # only look for NSEQ in (at most) the first 15 lines of the HMM header,
+    # so that HMMs out of range are rejected without further work
+    num_seq = None
+    with open(path, 'rb') as f:
+        for _ in range(15):
+            line = f.readline()
+            if not line:
+                break
+            if line.startswith(b'NSEQ '):
+                num_seq = int(line.split()[1])
+                break
+    assert num_seq is not None, 'NSEQ not found in HMMBuild file {}!'.format(path)
+
+    # one exception is that the backbone does not have enough sequences,
+    # so only one HMM is built
+    if not ((num_seq <= upper and num_seq >= lower) or keep_all):
+        return None
+    dirname = os.path.dirname(path)
+
+    # read number of sequences in the corresponding subalignment
+    # (not the one used in HMMs)
+    # (reuse the DirEntry from discoverHMMFiles if available)
+    subalignment_dir = os.path.dirname(dirname)
+    files = hmm_files.get(os.path.normpath(subalignment_dir)) \
+            if hmm_files is not None else None
+    if files is not None and files['subalignment'] is not None:
+        subalignment_path = files['subalignment'].path
+        assert files['subalignment'].is_file()
+    else:
+        subalignment_path = os.path.join(subalignment_dir, 'subset.aln.fasta')
+        assert os.path.exists(subalignment_path)
+    #subalignment_size = int(os.popen('wc -l {}'.format(subalignment_path)).read().strip().split(' ')[0]) // 2
+    #out = subprocess.Popen(['wc', '-l', subalignment_path],
+    #                        stdout=subprocess.PIPE,
+    #                        stderr=subprocess.STDOUT
+    #                        ).communicate()[0]
+    #subalignment_size = int(out.partition(b' ')[0]) // 2
+    subalignment_size = countFastaRecords(subalignment_path)
+    
+    # get alignment and assignment subproblem indexes
+    index = os.path.basename(dirname)
+    _, alignment_ind, hmm_ind = index.split('_')
+    alignment_ind, hmm_ind = int(alignment_ind), int(hmm_ind)
+    return index, dirname, alignment_ind, hmm_ind, num_seq, subalignment_size
+
 '''
 Obtain HMMs that have sizes within the given range
+Optionally using the files found by discoverHMMFiles
 '''
-def obtainHMMs(indir, lower, upper, hmmbuild_paths=[]):
+def obtainHMMs(indir, lower, upper, hmmbuild_paths=[], hmm_files=None):
     Configs.log('Obtaining HMMs in given range: [{}, {}]'.format(lower, upper))
     start = time.time()
 
     if len(hmmbuild_paths) == 0:
-        hmmbuild_paths = os.popen('find {} -name hmmbuild.model.* -type f'.format(
-            indir)).read().split('\n')[:-1]
+        if hmm_files is None:
+            hmm_files = discoverHMMFiles(indir)
+        hmmbuild_paths = [path for files in hmm_files.values()
+                for path in files['hmmbuild']]
 
     #hmms_in_range = []
     hmm_indexes = []
     index_to_hmms = {}
 
-    for path in hmmbuild_paths:
-        lines = os.popen('head -n 15 {}'.format(path)).read().split('\n')[:-1]
-        split_lines = [l.split() for l in lines]
-        _dict = {x[0]: ','.join(x[1:]) for x in split_lines}
-        assert 'NSEQ' in _dict, 'NSEQ not found in HMMBuild file {}!'.format(path)
-        num_seq = int(_dict['NSEQ'])
-
-        # one exception is that the backbone does not have enough sequences,
-        # so only one HMM is built
-        if (num_seq <= upper and num_seq >= lower) or len(hmmbuild_paths) == 1:
-            #hmms_in_range.append(path)
-            dirname = os.path.dirname(path)
-
-            # read number of sequences in the corresponding subalignment
-            # (not the one used in HMMs)
-            subalignment_path = os.path.join('/'.join(dirname.split('/')[:-1]),
-                    'subset.aln.fasta')
-            assert os.path.exists(subalignment_path)
-            #subalignment_size = int(os.popen('wc -l {}'.format(subalignment_path)).read().strip().split(' ')[0]) // 2
-            #out = subprocess.Popen(['wc', '-l', subalignment_path],
-            #                        stdout=subprocess.PIPE,
-            #                        stderr=subprocess.STDOUT
-            #                        ).communicate()[0]
-            #subalignment_size = int(out.partition(b' ')[0]) // 2
-            raw = subprocess.check_output(
-                    'wc -l {}; exit 0'.format(subalignment_path),
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True, shell=True)
-            subalignment_size = int(raw.strip().split(' ')[0]) // 2
-            
-            # get alignment and assignment subproblem indexes
-            index = dirname.split('/')[-1]
-            alignment_ind, hmm_ind = (int(x) for x in index.split('_')[1:])
-            hmm_indexes.append((alignment_ind, subalignment_size, 
-                hmm_ind, num_seq))
-            #print(hmm_indexes[-1])
-            index_to_hmms[index] = (dirname, alignment_ind, hmm_ind, num_seq)
+    func = partial(readHMMInfo, lower, upper, len(hmmbuild_paths) == 1,
+            hmm_files)
+    with ThreadPoolExecutor(max_workers=_max_io_workers) as executor:
+        hmm_infos = list(executor.map(func, hmmbuild_paths))
+
+    for info in hmm_infos:
+        if info is None:
+            continue
+        index, dirname, alignment_ind, hmm_ind, num_seq, subalignment_size = info
+        hmm_indexes.append((alignment_ind, subalignment_size, 
+            hmm_ind, num_seq))
+        #print(hmm_indexes[-1])
+        index_to_hmms[index] = (dirname, alignment_ind, hmm_ind, num_seq)
     
     # sort by the subalignment size
     hmm_indexes = sorted(hmm_indexes, key=lambda x: x[1], reverse=True)
@@ -66,37 +172,97 @@ def obtainHMMs(indir, lower, upper, hmmbuild_paths=[]):
         time_filter))
     return hmm_indexes, index_to_hmms
 
+'''
+Read all hmmsearch results of a single HMM. Returns a list of taxa and
+a matching list of (alignment_ind, hmm_ind, bitscore)
+'''
+def readHMMSearchResults(val, hmmsearch_paths=None):
+    hmmdir, alignment_ind, hmm_ind, num_seq = val
+
+    #hmmsearch_paths = os.popen('find {} -name hmmsearch.results.* -type f'.format(
+    #    hmmdir)).read().split('\n')[:-1]
+    if hmmsearch_paths is None:
+        hmmsearch_paths = findFiles(hmmdir, 'hmmsearch.results.')
+
+    taxa, entries = [], []
+    for path in hmmsearch_paths:
+        with open(path, 'r') as f:
+            this_scores = readHMMSearchScores(f.read())
+        taxa.extend(this_scores.keys())
+        # score[1] refers to bit-score
+        # we directly refer to the corresponding alignment subproblem
+        entries.extend([(alignment_ind, hmm_ind, score[1])
+            for score in this_scores.values()])
+    return taxa, entries
+
+'''
+Group hmmsearch results by taxon with NumPy structured arrays. Returns a
+dictionary of taxon -> [(alignment_ind, hmm_ind, bitscore), ...], with
+taxa in the order they are first seen. If ranked, each list is sorted by
+bit-scores (descending); otherwise only the entry with the highest
+bit-score is moved to the front
+'''
+def rankHMMSearchResults(all_results, ranked=True):
+    # counting pass, then fill a pre-sized array with the results of each HMM
+    total = sum(len(taxa) for taxa, _ in all_results)
+    if total == 0:
+        return {}
+    entries = np.empty(total, dtype=_score_dtype)
+    offset = 0
+    for _, hmm_entries in all_results:
+        if len(hmm_entries) > 0:
+            entries[offset:offset + len(hmm_entries)] = hmm_entries
+            offset += len(hmm_entries)
+    taxa = np.array(list(chain.from_iterable(r[0] for r in all_results)))
+    uniq, first, codes = np.unique(taxa, return_index=True,
+            return_inverse=True)
+    codes = codes.reshape(-1)
+    counts = np.bincount(codes)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # group entries by taxon (stable), and by descending bit-scores if ranked
+    if ranked:
+        order = np.lexsort((-entries['bitscore'], codes))
+    else:
+        order = np.argsort(codes, kind='stable')
+        # first position in each group that has the highest bit-score
+        grouped = entries['bitscore'][order]
+        gmax = np.maximum.reduceat(grouped, starts)
+        is_max = np.flatnonzero(grouped == np.repeat(gmax, counts))
+        _, pos = np.unique(codes[order][is_max], return_index=True)
+        best = is_max[pos]
+        order[starts], order[best] = order[best], order[starts]
+
+    rows = entries[order].tolist()
+    uniq, starts, counts = uniq.tolist(), starts.tolist(), counts.tolist()
+    scores = {}
+    for code in np.argsort(first, kind='stable').tolist():
+        scores[uniq[code]] = rows[starts[code]:starts[code] + counts[code]]
+    return scores
+
 '''
 Obtain hmmsearch results
+If ranked is False, only the first entry of each taxon is guaranteed to
+have the highest bit-score (the rest are not sorted)
+Optionally using the files found by discoverHMMFiles, otherwise each HMM
+directory is searched on its own
 '''
-def getHMMSearchResults(index_to_hmms):
+def getHMMSearchResults(index_to_hmms, ranked=True, hmm_files=None):
     Configs.log('Getting all targeted (within range) HMMSearch results')
     start = time.time()
     
-    scores = defaultdict(list)
-    for index, val in index_to_hmms.items():
-        hmmdir, alignment_ind, hmm_ind, num_seq = val
-
-        #hmmsearch_paths = os.popen('find {} -name hmmsearch.results.* -type f'.format(
-        #    hmmdir)).read().split('\n')[:-1]
-        raw = subprocess.check_output(
-                'find {} -name hmmsearch.results.* -type f'.format(hmmdir),
-                stderr= subprocess.STDOUT,
-                universal_newlines=True, shell=True)
-        hmmsearch_paths = raw.strip().split('\n')
-
-        for path in hmmsearch_paths:
-            with open(path, 'r') as f:
-                this_scores = eval(f.read())
-                for taxon, score in this_scores.items():
-                    # score[1] refers to bit-score
-                    # we directly refer to the corresponding alignment subproblem
-                    #scores[taxon].append((hmm_ind, score[1]))
-                    scores[taxon].append((alignment_ind, hmm_ind, score[1]))
-
-    # sort by bit-scores
-    for taxon in scores.keys():
-        scores[taxon] = sorted(scores[taxon], key=lambda x: x[2], reverse=True)
+    vals = list(index_to_hmms.values())
+    all_hmmsearch_paths = [None] * len(vals)
+    if hmm_files is not None:
+        for i, val in enumerate(vals):
+            files = hmm_files.get(os.path.normpath(val[0]))
+            if files is not None:
+                all_hmmsearch_paths[i] = files['hmmsearch']
+    with ThreadPoolExecutor(max_workers=_max_io_workers) as executor:
+        all_results = list(executor.map(readHMMSearchResults,
+            vals, all_hmmsearch_paths))
+
+    scores = rankHMMSearchResults(all_results, ranked)
 
     time_get_and_rank = time.time() - start
     Configs.log('Done getting all targeted (within range) HMMSearch results')
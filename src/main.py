@@ -4,7 +4,7 @@ from configs import *
 from src.algorithm import DecompositionAlgorithm, SearchAlgorithm
 from src.backbone import BackboneJob
 from src.loader import obtainHMMs, getHMMSearchResults, \
-        assignQueryToSubset, writeTempBackbone
+        assignQueryToSubset, writeTempBackbone, discoverHMMFiles
 from src.writer import writeSubAlignment, writeSubQueries
 from src.aligner import alignSubQueries
 from src.merger import mergeAlignments
@@ -134,8 +134,11 @@ def mainAlignmentProcess(args):
     # hmm_indexes are sorted by their nums of sequences in desending order
     # index to hmms keys=(subset dirname, num seq of the sub-alignment)
     # Optionally using the built paths, which are the ones used
+    # (HMMBuild/HMMSearch files are found in a single directory walk)
+    hmm_files = discoverHMMFiles(Configs.hmmdir)
     hmm_indexes, index_to_hmms = obtainHMMs(Configs.hmmdir,
-            Configs.lower, Configs.upper, hmmbuild_paths=hmmbuild_paths)
+            Configs.lower, Configs.upper, hmmbuild_paths=hmmbuild_paths,
+            hmm_files=hmm_files)
 
     # obtain weights
     weight_path = Configs.outdir + '/weights.txt'
@@ -143,7 +146,11 @@ def mainAlignmentProcess(args):
         print('\nFound existing weights: {}'.format(weight_path))
         scores = readWeightsFromLocal(weight_path)
     else:
-        scores = getHMMSearchResults(index_to_hmms)
+        # the fully ranked bit-scores are only needed when they are saved
+        # as is (weights are ranked on their own)
+        scores = getHMMSearchResults(index_to_hmms,
+                ranked=(not Configs.use_weight) and Configs.save_weight,
+                hmm_files=hmm_files)
         # use adjusted bitscore for assignment if specified
         if Configs.use_weight:
             print('\nCalculating weights (adjusted bit-scores)...')